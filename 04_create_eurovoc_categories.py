@@ -18,84 +18,85 @@ and finally alphabetically by the n-gram itself (ascending).
 """
 
 import argparse
-import csv
-from collections import Counter
+import numpy as np
+import pandas as pd
 
 def process_eurovoc_metadata(metadata_file, output_file):
     """
     Reads the metadata file, processes the 'eurovoc' column,
     and writes the sorted n-gram counts to the output file.
     """
-    # Use a Counter to store the frequency of each n-gram
-    ngram_counts = Counter()
-    
     print(f"Reading metadata from {metadata_file}...")
 
     try:
-        with open(metadata_file, mode='r', encoding='utf-8') as f:
-            # Use DictReader to easily access the 'eurovoc' column
-            reader = csv.DictReader(f)
-            
-            for row in reader:
-                # Check if the 'eurovoc' column exists and is not empty
-                eurovoc_data = row.get('eurovoc')
-                if eurovoc_data:
-                    # Split the column content by the '|' delimiter
-                    phrases = eurovoc_data.split('|')
-                    
-                    for phrase in phrases:
-                        # Clean up leading/trailing whitespace
-                        cleaned_phrase = phrase.strip()
-                        
-                        # Only count non-empty phrases
-                        if cleaned_phrase:
-                            ngram_counts[cleaned_phrase] += 1
+        # Only the 'eurovoc' column is needed; read it as plain strings
+        # (keep_default_na=False so phrases like "NA" are not turned into NaN)
+        try:
+            df = pd.read_csv(
+                metadata_file,
+                usecols=lambda column: column == 'eurovoc',
+                # Extra fields in a row are ignored rather than taken as an index
+                index_col=False,
+                dtype=str,
+                keep_default_na=False,
+                encoding='utf-8'
+            )
+        except pd.errors.EmptyDataError:
+            # An empty file has no n-grams; the output gets only its header
+            df = pd.DataFrame({'eurovoc': pd.Series(dtype=str)})
+
+        if 'eurovoc' not in df.columns:
+            print("Error: A 'eurovoc' column was not found in the metadata file.")
+            return
+
+        # Split the column content by the '|' delimiter, one phrase per row,
+        # clean up leading/trailing whitespace and drop empty phrases
+        phrases = df['eurovoc'].str.split('|').explode().str.strip()
+        phrases = phrases[phrases.notna() & (phrases != '')]
+
+        # Frequency of each n-gram
+        ngram_counts = phrases.value_counts()
 
         print(f"Found {len(ngram_counts)} unique n-grams.")
 
         # --- Data Preparation for Sorting ---
-        
-        output_data = []
-        for ngram, count in ngram_counts.items():
-            # Calculate word count (splitting by space)
-            word_count = len(ngram.split())
-            # Calculate character length
-            char_length = len(ngram)
-            
-            output_data.append({
-                'ngram': ngram,
-                'word_count': word_count,
-                'char_length': char_length,
-                'count': count
-            })
+
+        output_data = ngram_counts.rename_axis('ngram').reset_index(name='count')
+        # Calculate word count (splitting by whitespace)
+        output_data['word_count'] = output_data['ngram'].str.split().str.len()
+        # Calculate character length
+        output_data['char_length'] = output_data['ngram'].str.len()
 
         # --- Sorting ---
         # Sort by: 1. word_count (desc), 2. char_length (desc), 3. ngram (asc)
-        sorted_data = sorted(
-            output_data,
-            key=lambda item: (-item['word_count'], -item['char_length'], item['ngram'])
-        )
+        # np.lexsort sorts by the last key first; the integer keys are
+        # negated for descending order
+        order = np.lexsort((
+            output_data['ngram'].to_numpy(),
+            -output_data['char_length'].to_numpy(),
+            -output_data['word_count'].to_numpy()
+        ))
+        sorted_data = output_data.iloc[order]
 
         # --- Writing Output ---
-        
+
         print(f"Writing sorted data to {output_file}...")
-        
-        with open(output_file, mode='w', encoding='utf-8', newline='') as f:
-            # Define the fieldnames for the output CSV
-            fieldnames = ['ngram', 'word_count', 'char_length', 'count']
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            
-            # Write the header row
-            writer.writeheader()
-            # Write all the sorted data
-            writer.writerows(sorted_data)
-            
+
+        # Define the column order for the output CSV
+        # (CRLF line endings, as written by the csv module)
+        fieldnames = ['ngram', 'word_count', 'char_length', 'count']
+        sorted_data.to_csv(
+            output_file,
+            columns=fieldnames,
+            index=False,
+            encoding='utf-8',
+            lineterminator='\r\n'
+        )
+
         print("Processing complete.")
 
     except FileNotFoundError:
         print(f"Error: The file {metadata_file} was not found.")
-    except KeyError:
-        print("Error: A 'eurovoc' column was not found in the metadata file.")
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
 
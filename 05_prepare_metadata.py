@@ -10,28 +10,60 @@ two reports:
 
 import argparse
 import csv
+import re
 import sys
 from collections import Counter, defaultdict
+import numpy as np
+import pandas as pd
 from tqdm import tqdm
 
+# Optional: faster CSV parsing
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pv
+except ImportError:
+    pa = None
+    pv = None
+
+# Number of metadata rows processed (and held in memory) at a time
+CHUNK_SIZE = 100000
+
+# Input columns used from the metadata file
+INPUT_COLUMNS = ['celex', 'eurovoc', 'date_adoption', 'date_in_force']
+
+# Year (YYYY) at the start of a date string, allowing leading whitespace
+YEAR_PATTERN = re.compile(r'^\s*(\d{4})')
+
+# Buffer size for reading CSV input files (larger than the 8 KiB default,
+# for fewer read calls on large files)
+READ_BUFFER_SIZE = 1 << 20
+
+# Bytes of the metadata file parsed at a time by the pyarrow streaming reader
+ARROW_BLOCK_SIZE = 16 << 20
+
 def load_eurovoc_mapping(mapping_file):
     """
-    Loads the Eurovoc mapping file and returns sets of n-grams
+    Loads the Eurovoc mapping file and returns frozensets of n-grams
     for finance (domain 24) and agriculture (domain 56).
+    N-grams are stored stripped and casefolded, so that categories are
+    matched regardless of case.
     """
     finance_ngrams = set()
     agriculture_ngrams = set()
     
     print(f"Loading Eurovoc mapping from {mapping_file}...")
     try:
-        with open(mapping_file, mode='r', encoding='utf-8') as f:
+        with open(mapping_file, mode='r', encoding='utf-8', buffering=READ_BUFFER_SIZE) as f:
             reader = csv.DictReader(f)
             for row in reader:
                 domain = row.get('eurovoc_domain')
-                ngram = row.get('ngram')
+                ngram = (row.get('ngram') or '').strip()
                 
                 if not ngram:
                     continue
+                
+                # Canonical form, interned once for the set lookups
+                ngram = sys.intern(ngram.casefold())
                     
                 if domain == '24':
                     finance_ngrams.add(ngram)
@@ -48,26 +80,57 @@ def load_eurovoc_mapping(mapping_file):
     print(f"Loaded {len(finance_ngrams)} finance n-grams (domain 24).")
     print(f"Loaded {len(agriculture_ngrams)} agriculture n-grams (domain 56).")
     
-    return finance_ngrams, agriculture_ngrams
+    return frozenset(finance_ngrams), frozenset(agriculture_ngrams)
 
-def get_year_from_date(date_data):
+def get_years_from_dates(date_data):
     """
-    Extracts the YYYY year from a date string.
-    Date string might be empty, YYYY-MM-DD, or YYYY-MM-DD | ...
+    Extracts the YYYY year from a pandas Series of date strings.
+    Date strings might be empty, YYYY-MM-DD, or YYYY-MM-DD | ...
+    Returns a Series with the year of the first listed date, or NaN.
     """
-    if not date_data:
-        return None
-    
-    # Get the first date if multiple are listed
-    first_date_str = date_data.split('|')[0].strip()
+    # The year is the first four digits of the first date, so a single
+    # anchored match replaces splitting on '|', stripping and slicing
+    return date_data.str.extract(YEAR_PATTERN, expand=False)
+
+def read_metadata_chunks(input_file):
+    """
+    Reads the metadata file and yields DataFrames of at most CHUNK_SIZE rows
+    with the INPUT_COLUMNS as plain strings (missing values and missing
+    columns as '').
     
-    # Check if it looks like a date (YYYY-MM-DD)
-    if len(first_date_str) >= 4:
-        year = first_date_str[:4]
-        if year.isdigit():
-            return year
-            
-    return None
+    If pyarrow is installed, the file is parsed with its streaming CSV
+    reader, ARROW_BLOCK_SIZE bytes at a time; only the INPUT_COLUMNS are
+    kept, as compact Arrow strings, and each batch is converted to pandas
+    in chunks of at most CHUNK_SIZE rows. Otherwise pandas' chunked CSV
+    reader is used.
+    """
+    if pv is not None:
+        reader = pv.open_csv(
+            input_file,
+            read_options=pv.ReadOptions(block_size=ARROW_BLOCK_SIZE),
+            # Titles may contain line breaks inside quoted values
+            parse_options=pv.ParseOptions(newlines_in_values=True),
+            convert_options=pv.ConvertOptions(
+                include_columns=INPUT_COLUMNS,
+                include_missing_columns=True,
+                column_types={column: pa.string() for column in INPUT_COLUMNS}
+            )
+        )
+        for batch in reader:
+            for start in range(0, batch.num_rows, CHUNK_SIZE):
+                yield batch.slice(start, CHUNK_SIZE).to_pandas().fillna('')
+    else:
+        chunks = pd.read_csv(
+            input_file,
+            usecols=lambda column: column in INPUT_COLUMNS,
+            dtype=str,
+            keep_default_na=False,
+            encoding='utf-8',
+            chunksize=CHUNK_SIZE
+        )
+        for df in chunks:
+            # Tolerate metadata files without some of the columns
+            yield df.reindex(columns=INPUT_COLUMNS, fill_value='')
 
 def process_metadata(input_file, finance_ngrams, agriculture_ngrams, output_identifier):
     """
@@ -75,8 +138,6 @@ def process_metadata(input_file, finance_ngrams, agriculture_ngrams, output_iden
     """
     
     # --- Collectors ---
-    # For $output_identifier-celex.csv
-    celex_output_data = [] 
     # For $output_identifier-categories.csv
     total_category_counts = Counter()
     
@@ -87,65 +148,86 @@ def process_metadata(input_file, finance_ngrams, agriculture_ngrams, output_iden
     agriculture_count = 0
     both_count = 0
 
+    # $output_identifier-celex.csv is written chunk by chunk while reading,
+    # so only one chunk of input rows (and, with pyarrow, one parsed block)
+    # is held in memory at a time
+    celex_file = f"{output_identifier}-celex.csv"
+
     print(f"\nProcessing metadata from {input_file}...")
     try:
-        with open(input_file, mode='r', encoding='utf-8') as f:
-            # Read all rows into memory to use tqdm with a total
-            # For very large files, this could be memory-intensive
-            # An alternative is to not show the total in tqdm
-            try:
-                reader = csv.DictReader(f)
-                rows = list(reader)
-                total_rows = len(rows)
-            except Exception as e:
-                print(f"Error reading input CSV: {e}. Check file format and encoding.", file=sys.stderr)
-                sys.exit(1)
-
-            if total_rows == 0:
-                print("Input file is empty. No output will be generated.", file=sys.stderr)
-                return
-
-            for row in tqdm(rows, desc="Processing metadata", unit="rows"):
-                celex = row.get('celex')
-                eurovoc_data = row.get('eurovoc', '')
-                date_adoption_data = row.get('date_adoption', '')
-                date_in_force_data = row.get('date_in_force', '')
+        # First pass: count lines only, to give tqdm a total
+        # (an upper bound if some quoted fields span several lines)
+        with open(input_file, mode='rb', buffering=READ_BUFFER_SIZE) as f:
+            total_lines = sum(1 for _ in f) - 1
+
+        if total_lines <= 0:
+            print("Input file is empty. No output will be generated.", file=sys.stderr)
+            return
 
+        print(f"Writing CELEX domain data to {celex_file}...")
+
+        # Second pass: process the rows in chunks
+        chunks = read_metadata_chunks(input_file)
+
+        fieldnames = ['celex', 'year_passed', 'year_enacted', 'is_finance', 'is_agriculture']
+
+        with open(celex_file, 'w', encoding='utf-8', newline='') as f_out, \
+             tqdm(total=total_lines, desc="Processing metadata", unit="rows") as pbar:
+            for chunk_number, df in enumerate(chunks):
                 # Get years
-                year_passed = get_year_from_date(date_adoption_data)
-                year_enacted = get_year_from_date(date_in_force_data)
+                df['year_passed'] = get_years_from_dates(df['date_adoption'])
+                df['year_enacted'] = get_years_from_dates(df['date_in_force'])
 
-                # Get all unique, stripped categories from the 'eurovoc' column
-                row_categories = {cat.strip() for cat in eurovoc_data.split('|') if cat.strip()}
+                # One (row, category) pair per unique, stripped category
+                # in the 'eurovoc' column
+                categories = df['eurovoc'].str.split('|').explode().str.strip()
+                categories = categories[categories.notna() & (categories != '')]
+                row_categories = pd.DataFrame({
+                    'row': categories.index,
+                    'category': categories.to_numpy()
+                }).drop_duplicates()
 
                 # --- Task 1: CELEX Domain Flagging ---
-                
-                # Check for overlap between row categories and domain n-gram sets
-                is_finance = 1 if not finance_ngrams.isdisjoint(row_categories) else 0
-                is_agriculture = 1 if not agriculture_ngrams.isdisjoint(row_categories) else 0
-                
-                celex_output_data.append({
-                    'celex': celex,
-                    'year_passed': year_passed,
-                    'year_enacted': year_enacted,
-                    'is_finance': is_finance, 
-                    'is_agriculture': is_agriculture
-                })
+
+                # Each distinct category is looked up in the domain n-gram sets
+                # once (casefolded, like the mapping); the results are spread
+                # back to the rows via the codes
+                codes, unique_categories = pd.factorize(row_categories['category'])
+                folded_categories = [c.casefold() for c in unique_categories]
+                in_finance = np.array([c in finance_ngrams for c in folded_categories], dtype=bool)
+                in_agriculture = np.array([c in agriculture_ngrams for c in folded_categories], dtype=bool)
+
+                # A row is flagged if any of its categories is in the domain n-gram set
+                row_categories['is_finance'] = in_finance[codes]
+                row_categories['is_agriculture'] = in_agriculture[codes]
+                flags = row_categories.groupby('row')[['is_finance', 'is_agriculture']].any()
+                flags = flags.reindex(df.index, fill_value=False)
+                df['is_finance'] = flags['is_finance'].astype(int)
+                df['is_agriculture'] = flags['is_agriculture'].astype(int)
+
+                # CRLF line endings, as written by the csv module (and in
+                # the categories file)
+                df.to_csv(
+                    f_out,
+                    columns=fieldnames,
+                    header=(chunk_number == 0),
+                    index=False,
+                    lineterminator='\r\n'
+                )
 
                 # Update stats
-                if is_finance:
-                    finance_count += 1
-                if is_agriculture:
-                    agriculture_count += 1
-                if is_finance and is_agriculture:
-                    both_count += 1
-                if is_finance or is_agriculture:
-                    domain_found_count += 1
+                total_rows += len(df)
+                finance_count += int(flags['is_finance'].sum())
+                agriculture_count += int(flags['is_agriculture'].sum())
+                both_count += int((flags['is_finance'] & flags['is_agriculture']).sum())
+                domain_found_count += int((flags['is_finance'] | flags['is_agriculture']).sum())
 
                 # --- Task 2: Category Count (Total) ---
-                
-                if row_categories:
-                    total_category_counts.update(row_categories)
+
+                category_counts = np.bincount(codes, minlength=len(unique_categories))
+                total_category_counts.update(dict(zip(unique_categories, category_counts.tolist())))
+
+                pbar.update(len(df))
 
     except FileNotFoundError:
         print(f"Error: Input file not found at {input_file}", file=sys.stderr)
@@ -154,19 +236,7 @@ def process_metadata(input_file, finance_ngrams, agriculture_ngrams, output_iden
         print(f"An unexpected error occurred during processing: {e}", file=sys.stderr)
         sys.exit(1)
 
-    # --- After Loop: Write File 1 and Print Stats ---
-    
-    celex_file = f"{output_identifier}-celex.csv"
-    print(f"\nWriting CELEX domain data to {celex_file}...")
-    try:
-        with open(celex_file, 'w', encoding='utf-8', newline='') as f:
-            fieldnames = ['celex', 'year_passed', 'year_enacted', 'is_finance', 'is_agriculture']
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(celex_output_data)
-        print(f"Successfully wrote {celex_file}")
-    except IOError as e:
-        print(f"Error writing to file {celex_file}: {e}", file=sys.stderr)
+    print(f"Successfully wrote {celex_file}")
 
     # Print debug stats for Task 1
     print("\n--- CELEX Domain Statistics ---")
@@ -186,16 +256,11 @@ def process_metadata(input_file, finance_ngrams, agriculture_ngrams, output_iden
     print(f"\nWriting total category counts to {categories_file}...")
     try:
         with open(categories_file, 'w', encoding='utf-8', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=['eurovoc_category', 'count'])
-            writer.writeheader()
+            writer = csv.writer(f)
+            writer.writerow(['eurovoc_category', 'count'])
             
             # Sort by category name for consistent output
-            for category in sorted(total_category_counts.keys()):
-                count = total_category_counts[category]
-                writer.writerow({
-                    'eurovoc_category': category, 
-                    'count': count
-                })
+            writer.writerows(sorted(total_category_counts.items()))
         print(f"Successfully wrote {categories_file}")
     except IOError as e:
         print(f"Error writing to file {categories_file}: {e}", file=sys.stderr)
@@ -6,83 +6,228 @@ to calculate readability scores (Flesch Reading Ease).
 
 This script requires the 'textstat' library.
 Install it using: pip install textstat
+
+Results are cached in a sidecar file next to the output file
+([output_file].cache), keyed by each TXT file's modification time and size,
+so that re-runs only analyze new or changed files.
+
+The optional --fast_counts mode replaces textstat's counts with a compiled
+single-pass counter and requires the 'numba' library.
+Install it using: pip install numba
 """
 
 import argparse
 import csv
+import hashlib
+import math
+import mmap
 import os
+import shelve
 import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 from tqdm import tqdm
 import textstat
+from measure_common import load_celex_list, match_txt_files
 
-def load_celex_list(celex_file):
+# Optional: only needed for --fast_counts
+try:
+    import numba
+except ImportError:
+    numba = None
+
+def count_text_stats(buf):
     """
-    Loads the CELEX list and filters for rows where 'is_finance'
-    or 'is_agriculture' is '1'.
+    Counts words, sentences and syllables in a single pass over the bytes
+    of a UTF-8 text (given as a numpy uint8 array). Used by --fast_counts
+    and compiled with numba.
+    
+    - A word is a whitespace-delimited token with at least one letter or
+      digit (any non-ASCII byte is taken to be part of a letter).
+    - A sentence ends with '.', '!' or '?' followed by whitespace or the end
+      of the text; a text with words has at least one sentence.
+    - The syllables of a word are its groups of consecutive vowels
+      (a, e, i, o, u, y), not counting a silent final 'e' (but counting '-le'),
+      with at least one syllable per word.
     
-    Returns a list of dictionaries, each containing celex, 
-    year_passed, year_enacted, is_finance, and is_agriculture 
-    for processing.
+    Returns a tuple:
+    (word_count, sentence_count, syllable_count)
     """
-    celex_to_process = []
-    print(f"Loading CELEX list from {celex_file}...")
-    try:
-        with open(celex_file, mode='r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                is_finance = row.get('is_finance', '0')
-                is_agriculture = row.get('is_agriculture', '0')
-                
-                if is_finance == '1' or is_agriculture == '1':
-                    celex = row.get('celex')
-                    if celex:
-                        celex_info = {
-                            'celex': celex,
-                            'year_passed': row.get('year_passed'),
-                            'year_enacted': row.get('year_enacted'),
-                            'is_finance': is_finance,
-                            'is_agriculture': is_agriculture
-                        }
-                        celex_to_process.append(celex_info)
-                        
-    except FileNotFoundError:
-        print(f"Error: CELEX file not found at {celex_file}", file=sys.stderr)
-        sys.exit(1)
-    except Exception as e:
-        print(f"Error reading CELEX file: {e}", file=sys.stderr)
-        sys.exit(1)
+    word_count = 0
+    sentence_count = 0
+    syllable_count = 0
+    
+    # State of the current token
+    word_chars = 0
+    vowel_groups = 0
+    prev_vowel = False
+    last_letter = 0
+    second_last_letter = 0
+    
+    n = len(buf)
+    for i in range(n + 1):
+        # A virtual space at the end closes the last token
+        b = int(buf[i]) if i < n else 32
         
-    print(f"Loaded {len(celex_to_process)} CELEX identifiers marked for processing.")
-    return celex_to_process
+        if b == 32 or (b >= 9 and b <= 13):
+            if word_chars > 0:
+                # Silent final 'e', except in '-le' endings
+                if last_letter == 101 and second_last_letter != 108 and vowel_groups > 1:
+                    vowel_groups -= 1
+                word_count += 1
+                syllable_count += max(vowel_groups, 1)
+            word_chars = 0
+            vowel_groups = 0
+            prev_vowel = False
+            last_letter = 0
+            second_last_letter = 0
+            continue
+        
+        # ASCII lowercase
+        if b >= 65 and b <= 90:
+            b += 32
+        
+        if b >= 97 and b <= 122:
+            word_chars += 1
+            is_vowel = (b == 97 or b == 101 or b == 105 or b == 111
+                        or b == 117 or b == 121)
+            if is_vowel and not prev_vowel:
+                vowel_groups += 1
+            prev_vowel = is_vowel
+            second_last_letter = last_letter
+            last_letter = b
+        else:
+            prev_vowel = False
+            if (b >= 48 and b <= 57) or b >= 128:
+                word_chars += 1
+            elif b == 46 or b == 33 or b == 63:
+                next_b = int(buf[i + 1]) if i + 1 < n else 32
+                if next_b == 32 or (next_b >= 9 and next_b <= 13):
+                    sentence_count += 1
+    
+    if word_count > 0 and sentence_count == 0:
+        sentence_count = 1
+    
+    return word_count, sentence_count, syllable_count
+
+if numba is not None:
+    count_text_stats = numba.njit(cache=True)(count_text_stats)
+
+def count_text_stats_textstat(clean_text):
+    """
+    Counts words, sentences and syllables in a text with textstat.
+    The syllable count is skipped (0) if there are no words or sentences.
+    
+    Returns a tuple:
+    (word_count, sentence_count, syllable_count)
+    """
+    # Use textstat's lexicon_count for a more accurate word count
+    word_count = textstat.lexicon_count(clean_text, removepunct=True)
+    sentence_count = textstat.sentence_count(clean_text)
+    
+    if word_count == 0 or sentence_count == 0:
+        return word_count, sentence_count, 0
+    
+    return word_count, sentence_count, textstat.syllable_count(clean_text)
+
+# textstat counts by content digest (blake2b) within a worker process,
+# least recently used first; at most TEXTSTAT_MEMO_SIZE texts are kept
+TEXTSTAT_MEMO_SIZE = 10000
+_textstat_counts_by_digest = OrderedDict()
 
-def analyze_txt_file(file_path):
+def legacy_round(number, points=0):
+    """
+    Rounds half away from zero to the given number of decimal digits,
+    like textstat's _legacy_round.
+    """
+    p = 10 ** points
+    return float(math.floor((number * p) + math.copysign(0.5, number))) / p
+
+def calculate_flesch_reading_ease(total_word_count, sentence_count, syllable_count):
+    """
+    Calculates the Flesch Reading Ease from word, sentence and syllable
+    counts, as textstat.flesch_reading_ease does for English: words per
+    sentence and syllables per word are rounded to 1 decimal and the
+    score to 2 decimals. Returns 0.0 when there are no words or sentences.
+    """
+    if total_word_count == 0 or sentence_count == 0:
+        return 0.0
+    
+    words_per_sentence = legacy_round(total_word_count / sentence_count, 1)
+    syllables_per_word = legacy_round(syllable_count / total_word_count, 1)
+    return legacy_round(
+        206.835
+        - 1.015 * words_per_sentence
+        - 84.6 * syllables_per_word,
+        2
+    )
+
+def analyze_txt_file(file_path, fast_counts=False):
     """
     Analyzes a single plain text (.txt) file for readability.
     
+    If fast_counts is True, words, sentences and syllables are counted
+    with count_text_stats on the raw bytes instead of with textstat.
+    
     Returns a tuple:
     (total_word_count, sentence_count, syllable_count, flesch_reading_ease, error_message)
     """
     try:
-        with open(file_path, mode='r', encoding='utf-8') as f:
-            # Read the entire file content as clean text
-            clean_text = f.read()
-        
-        if not clean_text:
-            return 0, 0, 0, 0, "No content found"
+        if fast_counts:
+            with open(file_path, mode='rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return 0, 0, 0, 0, "No content found"
+                
+                # 1. Get stats in one pass over the bytes
+                # The file is memory-mapped rather than read, so the counter
+                # scans the page cache directly instead of a copy of the file
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    buf = np.frombuffer(mm, dtype=np.uint8)
+                    total_word_count, sentence_count, syllable_count = count_text_stats(buf)
+                    # Release the view before the map is closed
+                    del buf
+            
+            if total_word_count == 0 or sentence_count == 0:
+                return total_word_count, sentence_count, 0, 0, None
+        else:
+            with open(file_path, mode='rb') as f:
+                # Read the entire file content; it is hashed as it is and
+                # only decoded if its counts are not known yet
+                data = f.read()
+            
+            if not data:
+                return 0, 0, 0, 0, "No content found"
 
-        # 1. Get stats
-        # Use textstat's lexicon_count for a more accurate word count
-        total_word_count = textstat.lexicon_count(clean_text, removepunct=True)
-        sentence_count = textstat.sentence_count(clean_text)
-        
-        # Handle edge case where textstat might fail on empty/no-sentence text
-        if total_word_count == 0 or sentence_count == 0:
-             return total_word_count, sentence_count, 0, 0, None
+            # 1. Get stats
+            # Identical texts (e.g. the same document under several CELEX
+            # ids) are only analyzed once per worker process
+            digest = hashlib.blake2b(data, digest_size=16).digest()
+            counts = _textstat_counts_by_digest.get(digest)
+            if counts is None:
+                clean_text = data.decode('utf-8')
+                # Line endings as in text mode (universal newlines)
+                if '\r' in clean_text:
+                    clean_text = clean_text.replace('\r\n', '\n').replace('\r', '\n')
+                counts = count_text_stats_textstat(clean_text)
+                _textstat_counts_by_digest[digest] = counts
+                if len(_textstat_counts_by_digest) > TEXTSTAT_MEMO_SIZE:
+                    _textstat_counts_by_digest.popitem(last=False)
+            else:
+                _textstat_counts_by_digest.move_to_end(digest)
+            total_word_count, sentence_count, syllable_count = counts
+            
+            # Handle edge case where textstat might fail on empty/no-sentence text
+            if total_word_count == 0 or sentence_count == 0:
+                 return total_word_count, sentence_count, 0, 0, None
 
-        syllable_count = textstat.syllable_count(clean_text)
-        
         # 2. Calculate Flesch Reading Ease
-        flesch_reading_ease = textstat.flesch_reading_ease(clean_text)
+        # Derived from the counts above rather than calling
+        # textstat.flesch_reading_ease, which would tokenize the whole
+        # text again for words, sentences and syllables.
+        flesch_reading_ease = calculate_flesch_reading_ease(
+            total_word_count, sentence_count, syllable_count
+        )
             
         return total_word_count, sentence_count, syllable_count, flesch_reading_ease, None
 
@@ -91,6 +236,32 @@ def analyze_txt_file(file_path):
     except Exception as e:
         return 0, 0, 0, 0, f"Error processing file: {e}"
 
+def analyze_worker(task):
+    """
+    Process pool entry point. Takes a (celex, txt_directory, fast_counts)
+    tuple and returns the result tuple of analyze_txt_file for [celex].txt.
+    
+    Kept at module level so it can be pickled by ProcessPoolExecutor.
+    """
+    celex, txt_directory, fast_counts = task
+    file_path = os.path.join(txt_directory, f"{celex}.txt")
+    return analyze_txt_file(file_path, fast_counts)
+
+def result_cache_key(celex, file_path, fast_counts):
+    """
+    Returns the result cache key for a TXT file, made of the CELEX id,
+    the file's modification time and size, and the counting mode.
+    Returns None if the file cannot be stat'ed.
+    """
+    try:
+        stat_result = os.stat(file_path)
+    except OSError:
+        return None
+    # The version suffix changes whenever the computed values change,
+    # so that results of earlier versions are not reused
+    mode = 'fast2' if fast_counts else 'textstat2'
+    return f"{celex}:{stat_result.st_mtime_ns}:{stat_result.st_size}:{mode}"
+
 def main():
     """
     Main function to parse arguments and coordinate processing.
@@ -113,111 +284,181 @@ def main():
         required=True,
         help="Path for the output CSV file with readability scores."
     )
+    parser.add_argument(
+        '--fast_counts',
+        action='store_true',
+        help="Count words, sentences and syllables with a compiled single-pass "
+             "counter (requires numba) instead of textstat. Much faster, but "
+             "the counts and scores are not identical to textstat's."
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=os.cpu_count(),
+        help="Number of worker processes (default: number of CPUs). Each worker "
+             "reads its own files, so using more workers than CPUs keeps the "
+             "CPUs busy while files are read from a slow or network disk."
+    )
+    parser.add_argument(
+        '--no_cache',
+        action='store_true',
+        help="Analyze all files, ignoring and not updating the result cache "
+             "([output_file].cache)."
+    )
     
     args = parser.parse_args()
     
+    if args.workers < 1:
+        print("Error: --workers must be at least 1.", file=sys.stderr)
+        sys.exit(1)
+    
+    if args.fast_counts and numba is None:
+        print("Error: --fast_counts requires the 'numba' library, which is not installed.", file=sys.stderr)
+        print("Please install it using: pip install numba", file=sys.stderr)
+        sys.exit(1)
+    
     # 1. Load the list of CELEX numbers to process
-    celex_list = load_celex_list(args.celex_list)
+    celex_list, celex_set_from_list = load_celex_list(args.celex_list)
     
     if not celex_list:
         print("No CELEX identifiers to process. Exiting.")
         return
 
     # --- File Matching Report ---
-    print(f"\nAnalyzing file match between {args.celex_list} and {args.txt_directory}...")
-    celex_set_from_list = {info['celex'] for info in celex_list}
-    
-    try:
-        txt_files_in_dir = [
-            f for f in os.listdir(args.txt_directory) 
-            if f.endswith('.txt') and os.path.isfile(os.path.join(args.txt_directory, f))
-        ]
-        celex_set_from_dir = {os.path.splitext(f)[0] for f in txt_files_in_dir}
-    except FileNotFoundError:
-        print(f"Error: TXT directory not found at {args.txt_directory}", file=sys.stderr)
-        sys.exit(1)
-    except Exception as e:
-        print(f"Error reading TXT directory: {e}", file=sys.stderr)
-        sys.exit(1)
-
-    matched_celex_count = len(celex_set_from_list.intersection(celex_set_from_dir))
-    list_not_found_in_dir_count = len(celex_set_from_list.difference(celex_set_from_dir))
-    dir_not_found_in_list_count = len(celex_set_from_dir.difference(celex_set_from_list))
-
-    print("\n--- File Matching Report ---")
-    print(f"  - CELEX IDs in list:          {len(celex_set_from_list)}")
-    print(f"  - .txt files in directory:    {len(celex_set_from_dir)}")
-    print(f"  ------------------------------")
-    print(f"  - Matched (in list & dir):    {matched_celex_count}")
-    print(f"  - In list, NOT in dir (.txt): {list_not_found_in_dir_count}")
-    print(f"  - In dir (.txt), NOT in list: {dir_not_found_in_list_count}")
-    print("------------------------------")
-    # --- End of Report ---
+    celex_set_from_dir = match_txt_files(args.celex_list, args.txt_directory, celex_set_from_list)
 
 
     # 2. Process each TXT file
-    output_data = []
+    fieldnames = [
+        'celex',
+        'year_passed',
+        'year_enacted',
+        'is_finance',
+        'is_agriculture',
+        'total_word_count',
+        'sentence_count',
+        'syllable_count',
+        'flesch_reading_ease'
+    ]
     files_not_found = 0
     files_processed = 0
     
     print(f"\nProcessing {len(celex_list)} entries from CELEX list...")
     
-    for celex_info in tqdm(celex_list, desc="Analyzing TXT", unit="file"):
-        celex = celex_info['celex']
-        file_path = os.path.join(args.txt_directory, f"{celex}.txt")
-        
-        total_words, sentences, syllables, flesch_score, error = analyze_txt_file(
-            file_path
-        )
-        
-        if error == "File not found":
-            files_not_found += 1
-        elif error:
-            print(f"Warning: Could not process {file_path}. Error: {error}", file=sys.stderr)
-        else:
-            files_processed += 1
-            
-        output_row = {
-            'celex': celex,
-            'year_passed': celex_info['year_passed'],
-            'year_enacted': celex_info['year_enacted'],
-            'is_finance': celex_info['is_finance'],
-            'is_agriculture': celex_info['is_agriculture'],
-            'total_word_count': total_words,
-            'sentence_count': sentences,
-            'syllable_count': syllables,
-            'flesch_reading_ease': flesch_score
-        }
-        output_data.append(output_row)
-        
-    print(f"\nProcessing complete. {files_processed} files analyzed.")
-    if files_not_found > 0:
-        print(f"Warning: {files_not_found} files listed in celex_list were not found in the TXT directory.", file=sys.stderr)
-
-    # 3. Write output file
-    print(f"\nWriting results to {args.output_file}...")
+    # Look up unchanged files in the result cache of earlier runs. The cache
+    # stays open for the run, so new results are stored as they arrive
+    cache_file = f"{args.output_file}.cache"
+    cache = None
+    cache_keys = {}
+    cached_results = {}
+    if not args.no_cache:
+        try:
+            cache = shelve.open(cache_file)
+            for celex_info in celex_list:
+                celex = celex_info['celex']
+                if celex not in celex_set_from_dir:
+                    continue
+                file_path = os.path.join(args.txt_directory, f"{celex}.txt")
+                key = result_cache_key(celex, file_path, args.fast_counts)
+                if key is None:
+                    continue
+                cache_keys[celex] = key
+                if key in cache:
+                    cached_results[celex] = cache[key]
+            print(f"Reusing cached results for {len(cached_results)} files from {cache_file}.")
+        except Exception as e:
+            print(f"Warning: Could not read result cache {cache_file}: {e}", file=sys.stderr)
+            if cache is not None:
+                cache.close()
+            cache = None
+            cache_keys = {}
+            cached_results = {}
+    
+    # Files are independent, so spread the reading and analysis over the
+    # worker processes; while one worker waits for a read, the others parse.
+    # chunksize amortizes the inter-process overhead over many small files.
+    # Only files present in the directory listing above are sent to the
+    # workers; the others are reported as not found without opening them.
+    tasks = [
+        (info['celex'], args.txt_directory, args.fast_counts) for info in celex_list
+        if info['celex'] in celex_set_from_dir and info['celex'] not in cached_results
+    ]
+    
+    # Each row is written as soon as its file is analyzed, so the results
+    # are never all held in memory
+    print(f"Writing results to {args.output_file}...")
     try:
-        fieldnames = [
-            'celex', 
-            'year_passed',
-            'year_enacted',
-            'is_finance',
-            'is_agriculture',
-            'total_word_count', 
-            'sentence_count',
-            'syllable_count',
-            'flesch_reading_ease'
-        ]
-        
-        with open(args.output_file, 'w', encoding='utf-8', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(output_data)
-            
-        print("Successfully wrote output file.")
-        
+        with open(args.output_file, 'w', encoding='utf-8', newline='') as f, \
+             ProcessPoolExecutor(max_workers=args.workers) as executor:
+            writer = csv.writer(f)
+            writer.writerow(fieldnames)
+
+            results = executor.map(analyze_worker, tasks, chunksize=32)
+
+            for celex_info in tqdm(celex_list, desc="Analyzing TXT", unit="file"):
+                celex = celex_info['celex']
+                file_path = os.path.join(args.txt_directory, f"{celex}.txt")
+
+                if celex in cached_results:
+                    result = cached_results[celex]
+                elif celex in celex_set_from_dir:
+                    result = next(results)
+                    # Only successful results are cached, so failures are retried.
+                    # Each is stored right away, so an interrupted run keeps them
+                    if cache is not None and result[4] is None and celex in cache_keys:
+                        try:
+                            cache[cache_keys[celex]] = result
+                        except Exception as e:
+                            print(f"Warning: Could not update result cache {cache_file}: {e}", file=sys.stderr)
+                            cache.close()
+                            cache = None
+                else:
+                    result = (0, 0, 0, 0, "File not found")
+
+                total_words, sentences, syllables, flesch_score, error = result
+
+                if error == "File not found":
+                    files_not_found += 1
+                elif error:
+                    print(f"Warning: Could not process {file_path}. Error: {error}", file=sys.stderr)
+                else:
+                    files_processed += 1
+
+                # Row values in the order of the output fieldnames
+                writer.writerow((
+                    celex,
+                    celex_info['year_passed'],
+                    celex_info['year_enacted'],
+                    celex_info['is_finance'],
+                    celex_info['is_agriculture'],
+                    total_words,
+                    sentences,
+                    syllables,
+                    flesch_score
+                ))
+
+        # Drop the results of files that were deleted or have changed since,
+        # so the cache does not keep growing across runs
+        if cache is not None:
+            try:
+                current_keys = set(cache_keys.values())
+                for key in [key for key in cache.keys() if key not in current_keys]:
+                    del cache[key]
+            except Exception as e:
+                print(f"Warning: Could not prune result cache {cache_file}: {e}", file=sys.stderr)
+
     except IOError as e:
         print(f"Error writing output file: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if cache is not None:
+            cache.close()
+
+    print("Successfully wrote output file.")
+
+    print(f"\nProcessing complete. {files_processed} files analyzed.")
+    if files_not_found > 0:
+        print(f"Warning: {files_not_found} files listed in celex_list were not found in the TXT directory.", file=sys.stderr)
         
 if __name__ == "__main__":
     # Check for required library imports
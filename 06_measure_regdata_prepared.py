@@ -4,78 +4,266 @@
 Analyzes plain text (.txt) files corresponding to a given CELEX list 
 to count the occurrence of specific regulatory words ("shall", "must", 
 "may not", "required", "prohibited").
+
+If the optional 'hyperscan' library is installed, all words are counted
+in a single pass over each text.
+Install it using: pip install hyperscan
+Otherwise, if the optional 'pyahocorasick' library is installed, the plain
+words are found in a single Aho-Corasick pass.
+Install it using: pip install pyahocorasick
 """
 
 import argparse
+import codecs
 import csv
+import mmap
 import os
 import re
 import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 from tqdm import tqdm
+from measure_common import load_celex_list, match_txt_files
+
+# Optional: single-pass multi-pattern matching
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+# Optional: single-pass keyword matching where Hyperscan is not available
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# A pattern that matches a plain word, e.g. r'\bshall\b'
+PLAIN_WORD_PATTERN = re.compile(r'\\b(\w+)\\b')
+
+# Whitespace as in str.split(): ASCII whitespace bytes of the UTF-8 text...
+IS_ASCII_SPACE = np.zeros(256, dtype=bool)
+IS_ASCII_SPACE[list(b' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f')] = True
+
+# ...and the multi-byte UTF-8 sequences of the Unicode whitespace characters,
+# as integers (lead byte first) by sequence length
+UNICODE_SPACE_SEQUENCES = [
+    character.encode('utf-8') for character in
+    '\x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007'
+    '\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000'
+]
+UNICODE_SPACE_CODES = {
+    length: np.array([
+        int.from_bytes(sequence, 'big') for sequence in UNICODE_SPACE_SEQUENCES
+        if len(sequence) == length
+    ])
+    for length in (2, 3)
+}
+IS_SPACE_LEAD_BYTE = np.zeros(256, dtype=bool)
+IS_SPACE_LEAD_BYTE[[sequence[0] for sequence in UNICODE_SPACE_SEQUENCES]] = True
+
+# \s for bytes patterns on UTF-8 text (re and Hyperscan), matching the same
+# characters as \s in str patterns, e.g. the no-break spaces common in
+# EUR-Lex texts
+BYTES_SPACE_PATTERN = b'(?:[\\s\\x1c-\\x1f]|' + b'|'.join(
+    re.escape(sequence) for sequence in UNICODE_SPACE_SEQUENCES
+) + b')'
 
-def load_celex_list(celex_file):
+# The literal word a bytes pattern starts with, e.g. b'may' in rb'\bmay\s+not\b'
+LEADING_WORD_PATTERN = re.compile(rb'\\b(\w+)')
+
+# A bytes pattern that matches a plain word, e.g. rb'\bshall\b'
+PLAIN_WORD_BYTES_PATTERN = re.compile(rb'\\b\w+\\b')
+
+# Word characters of bytes patterns (\w, ASCII only)
+WORD_BYTES = frozenset(b'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_')
+
+def compile_hyperscan_database(word_patterns):
     """
-    Loads the CELEX list and filters for rows where 'is_finance'
-    or 'is_agriculture' is '1'.
+    Compiles all word patterns (case-insensitive) into one Hyperscan
+    database, so a text is scanned once for all of them. The id of each
+    pattern is its position in word_patterns.
     
-    Returns a list of dictionaries, each containing celex, 
-    year_passed, year_enacted, is_finance, and is_agriculture 
-    for processing.
+    The patterns are compiled for bytes, like the bytes regexes: word
+    boundaries (\b) only treat ASCII letters, digits and '_' as word
+    characters, and \s matches the UTF-8 sequences of BYTES_SPACE_PATTERN.
+    Without UTF-8 mode, the results on invalid UTF-8 are well defined.
     """
-    celex_to_process = []
-    print(f"Loading CELEX list from {celex_file}...")
-    try:
-        with open(celex_file, mode='r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                is_finance = row.get('is_finance', '0')
-                is_agriculture = row.get('is_agriculture', '0')
-                
-                if is_finance == '1' or is_agriculture == '1':
-                    celex = row.get('celex')
-                    if celex:
-                        celex_info = {
-                            'celex': celex,
-                            'year_passed': row.get('year_passed'),
-                            'year_enacted': row.get('year_enacted'),
-                            'is_finance': is_finance,
-                            'is_agriculture': is_agriculture
-                        }
-                        celex_to_process.append(celex_info)
-                        
-    except FileNotFoundError:
-        print(f"Error: CELEX file not found at {celex_file}", file=sys.stderr)
-        sys.exit(1)
-    except Exception as e:
-        print(f"Error reading CELEX file: {e}", file=sys.stderr)
-        sys.exit(1)
-        
-    print(f"Loaded {len(celex_to_process)} CELEX identifiers marked for processing.")
-    return celex_to_process
+    expressions = [
+        pattern.encode('utf-8').replace(b'\\s', BYTES_SPACE_PATTERN)
+        for pattern in word_patterns.values()
+    ]
+    flags = hyperscan.HS_FLAG_CASELESS
+    database = hyperscan.Database()
+    database.compile(
+        expressions=expressions,
+        ids=list(range(len(word_patterns))),
+        elements=len(word_patterns),
+        flags=[flags] * len(word_patterns)
+    )
+    return database
 
-def analyze_txt_file(file_path, regex_patterns):
+def compile_keyword_automaton(word_patterns):
+    """
+    Builds an Aho-Corasick automaton over the lowercased plain words
+    (r'\bword\b') in word_patterns. The value stored for each word is
+    a (key, word) tuple.
+    
+    The automaton is run over lowercased bytes decoded as Latin-1 (one
+    character per byte), so that word boundaries are checked on the bytes
+    with WORD_BYTES, as by the bytes regexes and Hyperscan.
+    
+    Returns None if none of the patterns is a plain word.
+    """
+    automaton = ahocorasick.Automaton()
+    for key, pattern in word_patterns.items():
+        match = PLAIN_WORD_PATTERN.fullmatch(pattern)
+        if match:
+            word = match.group(1).lower()
+            automaton.add_word(word, (key, word))
+    
+    if len(automaton) == 0:
+        return None
+    automaton.make_automaton()
+    return automaton
+
+def count_matches(pattern, data, lower_data):
+    """
+    Counts the (non-overlapping) matches of a case-insensitive bytes
+    pattern in data. lower_data is data in lowercase.
+    
+    If the pattern starts with a literal word, the regex is only tried
+    where that word occurs, found with bytes.find in lower_data, instead
+    of at every position of the text. A pattern that is just a plain word
+    needs no regex at all; only the bytes around each occurrence are
+    checked for word boundaries.
+    """
+    leading_word = LEADING_WORD_PATTERN.match(pattern.pattern)
+    if not leading_word:
+        return sum(1 for _ in pattern.finditer(data))
+    
+    word = leading_word.group(1).lower()
+    count = 0
+    
+    if PLAIN_WORD_BYTES_PATTERN.fullmatch(pattern.pattern):
+        length = len(lower_data)
+        position = lower_data.find(word)
+        while position != -1:
+            end = position + len(word)
+            if (position == 0 or lower_data[position - 1] not in WORD_BYTES) and \
+               (end == length or lower_data[end] not in WORD_BYTES):
+                count += 1
+            # An overlapping occurrence would follow a word character
+            position = lower_data.find(word, end)
+        return count
+    
+    position = lower_data.find(word)
+    while position != -1:
+        match = pattern.match(data, position)
+        if match:
+            count += 1
+            position = lower_data.find(word, match.end())
+        else:
+            position = lower_data.find(word, position + 1)
+    return count
+
+def count_words(data):
+    """
+    Counts the words (runs of non-whitespace characters, as str.split())
+    in UTF-8 encoded text given as a bytes-like object.
+    
+    Works on the whole buffer with numpy instead of building a list of
+    all words.
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if buf.size == 0:
+        return 0
+    
+    is_space = IS_ASCII_SPACE[buf]
+    
+    # Mark the bytes of multi-byte whitespace characters, checking only
+    # the (few) positions that hold one of their lead bytes
+    lead_positions = np.flatnonzero(IS_SPACE_LEAD_BYTE[buf])
+    if lead_positions.size:
+        codes = buf[lead_positions].astype(np.int64)
+        for length in (2, 3):
+            next_byte = buf[np.minimum(lead_positions + length - 1, buf.size - 1)]
+            codes = (codes << 8) | next_byte
+            is_match = np.isin(codes, UNICODE_SPACE_CODES[length])
+            is_match &= lead_positions + length <= buf.size
+            positions = lead_positions[is_match]
+            for offset in range(length):
+                is_space[positions + offset] = True
+    
+    # A word starts at each non-whitespace byte after whitespace (or at 0)
+    word_starts = ~is_space
+    word_starts[1:] &= is_space[:-1]
+    return int(np.count_nonzero(word_starts))
+
+def analyze_txt_file(file_path, regex_patterns, hs_database=None, keyword_automaton=None):
     """
     Analyzes a single plain text (.txt) file.
+    The words are counted with hs_database (compiled from the same patterns
+    as regex_patterns) if given. Otherwise the plain words in
+    keyword_automaton are counted in one pass if it is given, and the
+    remaining patterns with one regex pass each.
     
     Returns a tuple:
     (total_word_count, counts_dict, total_obligation_count, error_message)
     """
     try:
-        with open(file_path, mode='r', encoding='utf-8') as f:
-            # Read the entire file content as clean text
-            clean_text = f.read()
+        with open(file_path, mode='rb') as f:
+            # An empty file cannot be memory-mapped (and has no words)
+            if os.fstat(f.fileno()).st_size == 0:
+                return 0, dict.fromkeys(regex_patterns, 0), 0, None
             
-        # 1. Get total word count
-        total_word_count = len(clean_text.split())
-        
-        # 2. Count obligation words (case-insensitive)
-        counts_dict = {}
-        total_obligation_count = 0
+            # The text is read through the page cache instead of being
+            # copied into a bytes object
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as text_map:
+                # The counting below works on the bytes, so check first that
+                # they are valid UTF-8; a UnicodeDecodeError is reported as
+                # an error, as for a file read as text
+                codecs.utf_8_decode(text_map, 'strict', True)
+                
+                # 1. Get total word count
+                total_word_count = count_words(text_map)
+                
+                # 2. Count obligation words (case-insensitive)
+                if hs_database is not None:
+                    # A single scan of the raw UTF-8 bytes reports every
+                    # match with the id of its pattern
+                    match_counts = [0] * len(regex_patterns)
+                    
+                    def on_match(pattern_id, start, end, flags, context):
+                        match_counts[pattern_id] += 1
+                    
+                    # Hyperscan only accepts bytes, not other buffers
+                    hs_database.scan(text_map[:], match_event_handler=on_match)
+                    counts_dict = dict(zip(regex_patterns, match_counts))
+                else:
+                    counts_dict = {}
+                    lower_data = text_map[:].lower()
+                    
+                    if keyword_automaton is not None:
+                        # One pass over the lowercased bytes finds all plain
+                        # words; a hit counts if it is not part of a longer
+                        # word (as \b). Latin-1 maps each byte to one
+                        # character, so positions are the same in both
+                        length = len(lower_data)
+                        for key, word in keyword_automaton.values():
+                            counts_dict[key] = 0
+                        for end, (key, word) in keyword_automaton.iter(lower_data.decode('latin-1')):
+                            start = end - len(word) + 1
+                            if (start == 0 or lower_data[start - 1] not in WORD_BYTES) and \
+                               (end + 1 == length or lower_data[end + 1] not in WORD_BYTES):
+                                counts_dict[key] += 1
+                    
+                    # The other patterns run on the mapped bytes; matches
+                    # are counted without building a list of them
+                    remaining_keys = [key for key in regex_patterns if key not in counts_dict]
+                    for key in remaining_keys:
+                        counts_dict[key] = count_matches(regex_patterns[key], text_map, lower_data)
         
-        for key, pattern in regex_patterns.items():
-            count = len(pattern.findall(clean_text))
-            counts_dict[key] = count
-            total_obligation_count += count
+        total_obligation_count = sum(counts_dict.values())
             
         return total_word_count, counts_dict, total_obligation_count, None
 
@@ -84,6 +272,55 @@ def analyze_txt_file(file_path, regex_patterns):
     except Exception as e:
         return 0, {}, 0, f"Error processing file: {e}"
 
+def compile_matchers(word_patterns):
+    """
+    Compiles the word patterns for analyze_txt_file with the fastest
+    available engine.
+    
+    Returns a tuple:
+    (regex_patterns, hs_database, keyword_automaton)
+    """
+    # We use re.IGNORECASE for case-insensitive matching. The patterns
+    # are compiled as bytes, to run on the raw UTF-8 text.
+    regex_patterns = {
+        key: re.compile(
+            pattern.encode('utf-8').replace(b'\\s', BYTES_SPACE_PATTERN),
+            re.IGNORECASE
+        )
+        for key, pattern in word_patterns.items()
+    }
+    
+    hs_database = None
+    keyword_automaton = None
+    if hyperscan is not None:
+        hs_database = compile_hyperscan_database(word_patterns)
+    elif ahocorasick is not None:
+        keyword_automaton = compile_keyword_automaton(word_patterns)
+    
+    return regex_patterns, hs_database, keyword_automaton
+
+# Matchers of the current worker process, set by init_worker
+_worker_matchers = None
+
+def init_worker(word_patterns):
+    """
+    Process pool initializer. Compiles the word patterns once per worker
+    (a Hyperscan database cannot be pickled to the workers).
+    """
+    global _worker_matchers
+    _worker_matchers = compile_matchers(word_patterns)
+
+def analyze_worker(task):
+    """
+    Process pool entry point. Takes a (celex, txt_directory) tuple and
+    returns the result tuple of analyze_txt_file for [celex].txt.
+    
+    Kept at module level so it can be pickled by ProcessPoolExecutor.
+    """
+    celex, txt_directory = task
+    file_path = os.path.join(txt_directory, f"{celex}.txt")
+    return analyze_txt_file(file_path, *_worker_matchers)
+
 def main():
     """
     Main function to parse arguments and coordinate processing.
@@ -106,11 +343,22 @@ def main():
         required=True,
         help="Path for the output CSV file."
     )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=os.cpu_count(),
+        help="Number of worker processes (default: number of CPUs). Each worker "
+             "reads its own files, so using more workers than CPUs keeps the "
+             "CPUs busy while files are read from a slow or network disk."
+    )
     
     args = parser.parse_args()
+    
+    if args.workers < 1:
+        print("Error: --workers must be at least 1.", file=sys.stderr)
+        sys.exit(1)
 
-    # 1. Define word patterns and compile regex
-    # We use re.IGNORECASE for case-insensitive matching
+    # 1. Define word patterns (compiled in each worker process)
     word_patterns = {
         'shall': r'\bshall\b',
         'must': r'\bmust\b',
@@ -119,122 +367,112 @@ def main():
         'prohibited': r'\bprohibited\b'
     }
     
-    regex_patterns = {
-        key: re.compile(pattern, re.IGNORECASE) 
-        for key, pattern in word_patterns.items()
-    }
+    if hyperscan is not None:
+        print("Counting words with Hyperscan (single pass per file).")
+    elif ahocorasick is not None:
+        print("Counting plain words with Aho-Corasick (single pass per file).")
     
     # 2. Load the list of CELEX numbers to process
-    celex_list = load_celex_list(args.celex_list)
+    celex_list, celex_set_from_list = load_celex_list(args.celex_list)
     
     if not celex_list:
         print("No CELEX identifiers to process. Exiting.")
         return
 
-    # --- New File Matching Report ---
-    print(f"\nAnalyzing file match between {args.celex_list} and {args.txt_directory}...")
-    celex_set_from_list = {info['celex'] for info in celex_list}
-    
-    try:
-        txt_files_in_dir = [
-            f for f in os.listdir(args.txt_directory) 
-            if f.endswith('.txt') and os.path.isfile(os.path.join(args.txt_directory, f))
-        ]
-        celex_set_from_dir = {os.path.splitext(f)[0] for f in txt_files_in_dir}
-    except FileNotFoundError:
-        print(f"Error: TXT directory not found at {args.txt_directory}", file=sys.stderr)
-        sys.exit(1)
-    except Exception as e:
-        print(f"Error reading TXT directory: {e}", file=sys.stderr)
-        sys.exit(1)
-
-    matched_celex_count = len(celex_set_from_list.intersection(celex_set_from_dir))
-    list_not_found_in_dir_count = len(celex_set_from_list.difference(celex_set_from_dir))
-    dir_not_found_in_list_count = len(celex_set_from_dir.difference(celex_set_from_list))
-
-    print("\n--- File Matching Report ---")
-    print(f"  - CELEX IDs in list:          {len(celex_set_from_list)}")
-    print(f"  - .txt files in directory:    {len(celex_set_from_dir)}")
-    print(f"  ------------------------------")
-    print(f"  - Matched (in list & dir):    {matched_celex_count}")
-    print(f"  - In list, NOT in dir (.txt): {list_not_found_in_dir_count}")
-    print(f"  - In dir (.txt), NOT in list: {dir_not_found_in_list_count}")
-    print("------------------------------")
-    # --- End of New Report ---
+    # --- File Matching Report ---
+    celex_set_from_dir = match_txt_files(args.celex_list, args.txt_directory, celex_set_from_list)
 
 
     # 3. Process each TXT file based on the celex_list
-    output_data = []
+    fieldnames = [
+        'celex',
+        'year_passed',
+        'year_enacted',
+        'is_finance',
+        'is_agriculture',
+        'total_word_count',
+        'count_shall',
+        'count_must',
+        'count_may_not',
+        'count_required',
+        'count_prohibited',
+        'total_obligation_word_count'
+    ]
     files_not_found = 0
     files_processed = 0
-    
+
     print(f"\nProcessing {len(celex_list)} entries from CELEX list...")
+    print(f"Writing results to {args.output_file}...")
     
-    for celex_info in tqdm(celex_list, desc="Analyzing TXT", unit="file"):
-        celex = celex_info['celex']
-        # Look for .txt files
-        file_path = os.path.join(args.txt_directory, f"{celex}.txt")
-        
-        total_words, counts, total_obligation, error = analyze_txt_file(
-            file_path, regex_patterns
-        )
-        
-        if error == "File not found":
-            files_not_found += 1
-        elif error:
-            print(f"Warning: Could not process {file_path}. Error: {error}", file=sys.stderr)
-        else:
-            files_processed += 1
-            
-        output_row = {
-            'celex': celex,
-            'year_passed': celex_info['year_passed'],
-            'year_enacted': celex_info['year_enacted'],
-            'is_finance': celex_info['is_finance'],
-            'is_agriculture': celex_info['is_agriculture'],
-            'total_word_count': total_words,
-            'count_shall': counts.get('shall', 0),
-            'count_must': counts.get('must', 0),
-            'count_may_not': counts.get('may_not', 0),
-            'count_required': counts.get('required', 0),
-            'count_prohibited': counts.get('prohibited', 0),
-            'total_obligation_word_count': total_obligation
-        }
-        output_data.append(output_row)
-        
+    # Files are independent, so spread the reading and counting over the
+    # worker processes. chunksize amortizes the inter-process overhead over
+    # many small files. Only files present in the directory listing above
+    # are sent to the workers; the others are reported as not found.
+    tasks = [
+        (info['celex'], args.txt_directory) for info in celex_list
+        if info['celex'] in celex_set_from_dir
+    ]
+    
+    # Each row is written as soon as its file is analyzed, so the results
+    # are never all held in memory
+    try:
+        with open(args.output_file, 'w', encoding='utf-8', newline='') as f, \
+             ProcessPoolExecutor(
+                 max_workers=args.workers,
+                 initializer=init_worker,
+                 initargs=(word_patterns,)
+             ) as executor:
+            writer = csv.writer(f)
+            writer.writerow(fieldnames)
+
+            results = executor.map(analyze_worker, tasks, chunksize=32)
+
+            for celex_info in tqdm(celex_list, desc="Analyzing TXT", unit="file"):
+                celex = celex_info['celex']
+                # Look for .txt files
+                file_path = os.path.join(args.txt_directory, f"{celex}.txt")
+
+                if celex in celex_set_from_dir:
+                    result = next(results)
+                else:
+                    result = (0, {}, 0, "File not found")
+
+                total_words, counts, total_obligation, error = result
+
+                if error == "File not found":
+                    files_not_found += 1
+                elif error:
+                    print(f"Warning: Could not process {file_path}. Error: {error}", file=sys.stderr)
+                else:
+                    files_processed += 1
+
+                # Row values in the order of the output fieldnames
+                writer.writerow((
+                    celex,
+                    celex_info['year_passed'],
+                    celex_info['year_enacted'],
+                    celex_info['is_finance'],
+                    celex_info['is_agriculture'],
+                    total_words,
+                    counts.get('shall', 0),
+                    counts.get('must', 0),
+                    counts.get('may_not', 0),
+                    counts.get('required', 0),
+                    counts.get('prohibited', 0),
+                    total_obligation
+                ))
+
+    except IOError as e:
+        print(f"Error writing output file: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    print("Successfully wrote output file.")
+
     print(f"\nProcessing complete. {files_processed} files analyzed.")
     if files_not_found > 0:
         # This count should match 'In list, NOT in dir (.txt)' from the report
         print(f"Warning: {files_not_found} files listed in celex_list were not found in the TXT directory.", file=sys.stderr)
 
-    # 4. Write output file
-    print(f"\nWriting results to {args.output_file}...")
-    try:
-        fieldnames = [
-            'celex', 
-            'year_passed',
-            'year_enacted',
-            'is_finance',
-            'is_agriculture',
-            'total_word_count', 
-            'count_shall', 
-            'count_must', 
-            'count_may_not', 
-            'count_required', 
-            'count_prohibited',
-            'total_obligation_word_count'
-        ]
-        
-        with open(args.output_file, 'w', encoding='utf-8', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(output_data)
-            
-        print("Successfully wrote output file.")
-        
-    except IOError as e:
-        print(f"Error writing output file: {e}", file=sys.stderr)
-        
 if __name__ == "__main__":
     # Removed the check for BeautifulSoup, as it's no longer needed
     main()
@@ -10,51 +10,207 @@ standard deviations for finance and agriculture categories.
 
 import argparse
 import csv
+import math
+import os
+import pickle
 import sys
-import statistics
 from collections import defaultdict
+import pandas as pd
 
-def calculate_stats(values):
+# Number of word count rows processed (and held in memory) at a time
+CHUNK_SIZE = 100000
+
+# Whole numbers as accepted by int(), e.g. '1991' or ' 1991 '
+INTEGER_PATTERN = r'\s*[+-]?\d+\s*'
+
+def read_string_columns(file_path, columns):
+    """
+    Reads the given columns of a CSV file as plain strings, with missing
+    values and missing columns as ''. An empty file gives an empty DataFrame.
+    """
+    try:
+        df = pd.read_csv(
+            file_path,
+            usecols=lambda column: column in columns,
+            dtype=str,
+            keep_default_na=False,
+            encoding='utf-8'
+        )
+    except pd.errors.EmptyDataError:
+        # A file without even a header row has no rows either
+        return pd.DataFrame(columns=columns, dtype=str)
+    return df.reindex(columns=columns, fill_value='')
+
+def read_string_chunks(file_path, columns):
     """
-    Calculates count, total, mean, and standard deviation for a list of values.
-    Handles empty lists and lists with a single value.
+    Like read_string_columns, but yields DataFrames of at most
+    CHUNK_SIZE rows (none for an empty file).
     """
-    count = len(values)
+    try:
+        chunks = pd.read_csv(
+            file_path,
+            usecols=lambda column: column in columns,
+            dtype=str,
+            keep_default_na=False,
+            encoding='utf-8',
+            chunksize=CHUNK_SIZE
+        )
+    except pd.errors.EmptyDataError:
+        # A file without even a header row has no rows either
+        return
+    for df in chunks:
+        yield df.reindex(columns=columns, fill_value='')
+
+def to_integers(values):
+    """
+    Converts a Series of strings to integers.
+    Returns the integers (0 where invalid) and a mask of the valid values.
+    """
+    # Usually all values are valid and are parsed in one bulk conversion;
+    # only otherwise are the invalid ones looked for
+    try:
+        return values.astype('int64'), pd.Series(True, index=values.index)
+    except (ValueError, OverflowError):
+        pass
     
-    if count == 0:
-        return 0, 0.0, 0.0, 0.0
-        
-    total = sum(values)
-    mean = total / count
+    is_valid = values.str.fullmatch(INTEGER_PATTERN)
+    integers = values.where(is_valid, '0').astype('int64')
+    return integers, is_valid
+
+def to_floats(values):
+    """
+    Converts a Series of strings to floats as float() does (pd.to_numeric
+    can be off in the last digit). Returns 0.0 where a value is invalid.
+    """
+    # Usually all values are valid and are parsed in one bulk conversion
+    try:
+        return values.astype('float64')
+    except ValueError:
+        pass
+    
+    def parse(value):
+        try:
+            return float(value)
+        except ValueError:
+            return 0.0
+    return values.map(parse).astype('float64')
+
+def load_readability_scores(readability_file, use_cache=True):
+    """
+    Loads the readability scores into a Series of floats indexed by celex.
+    
+    The parsed scores are cached in a pickle next to the readability file
+    ([readability_file].scores.pkl) and reused as long as the file's
+    modification time and size are unchanged.
+    """
+    stat_result = os.stat(readability_file)
+    # The version (last) changes whenever the parsed values change, so that
+    # scores cached by earlier versions are not reused
+    file_key = (stat_result.st_mtime_ns, stat_result.st_size, 2)
+    cache_file = f"{readability_file}.scores.pkl"
     
-    # Standard deviation requires at least 2 data points
-    if count < 2:
-        stdev = 0.0
-    else:
-        stdev = statistics.stdev(values)
+    if use_cache:
+        try:
+            with open(cache_file, 'rb') as f:
+                cached_key, readability_scores = pickle.load(f)
+            if cached_key == file_key:
+                print(f"Using cached readability scores from {cache_file}.")
+                return readability_scores
+        except Exception:
+            pass # No usable cache; parse the CSV file
+    
+    readability = read_string_columns(readability_file, ['celex', 'flesch_reading_ease'])
+    readability = readability[readability['celex'] != '']
+    # The last row of a CELEX identifier wins
+    readability = readability.drop_duplicates('celex', keep='last').set_index('celex')
+    readability_scores = to_floats(readability['flesch_reading_ease']).fillna(0.0)
+    
+    if use_cache:
+        try:
+            with open(cache_file, 'wb') as f:
+                pickle.dump((file_key, readability_scores), f, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError as e:
+            print(f"Warning: Could not write readability cache {cache_file}: {e}", file=sys.stderr)
+    
+    return readability_scores
+
+class Moments:
+    """
+    Running count, total, mean and sum of squared deviations from the
+    mean (M2) of a group of values. Batches of values are merged in with
+    the parallel form of Welford's algorithm (Chan et al.), so the values
+    themselves are never stored. The total is summed value by value, as
+    sum() over all values would, so that total / n is their exact average.
+    """
+    __slots__ = ('n', 'total', 'mean', 'M2')
+    
+    def __init__(self):
+        self.n = 0
+        self.total = 0
+        self.mean = 0.0
+        self.M2 = 0.0
+    
+    def merge(self, values, mean, M2):
+        """
+        Merges in a batch of values (a list), given their mean and M2.
+        """
+        n = len(values)
+        if n == 0:
+            return
+        self.total = sum(values, self.total)
+        if self.n == 0:
+            # The first batch: take its moments as they are (the update
+            # below would not reproduce its mean exactly)
+            self.n, self.mean, self.M2 = n, mean, M2
+            return
+        combined_n = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / combined_n
+        self.M2 += M2 + delta * delta * self.n * n / combined_n
+        self.n = combined_n
+    
+    def stdev(self):
+        """
+        Returns the sample standard deviation (0.0 for fewer than 2 values).
+        """
+        # Standard deviation requires at least 2 data points
+        if self.n < 2:
+            return 0.0
+        return math.sqrt(self.M2 / (self.n - 1))
+
+def update_moments(year_stats, key, values, years):
+    """
+    Merges a batch of values, grouped by year, into the key's Moments of
+    each year in year_stats.
+    """
+    grouped = values.groupby(years)
+    moments = grouped.agg(['mean', 'var'])
+    for (year, group), (mean, variance) in zip(grouped, moments.itertuples(index=False)):
+        count = len(group)
+        # The variance is NaN for a single value
+        M2 = variance * (count - 1) if count > 1 else 0.0
+        year_stats[int(year)][key].merge(group.tolist(), float(mean), M2)
+
+def calculate_stats(moments):
+    """
+    Returns the count, total, mean, and standard deviation of Moments.
+    Handles empty groups and groups with a single value.
+    """
+    if moments.n == 0:
+        return 0, 0.0, 0.0, 0.0
         
-    return count, total, mean, stdev
+    return moments.n, moments.total, moments.total / moments.n, moments.stdev()
 
-def aggregate_data(word_count_file, readability_file, output_file):
+def aggregate_data(word_count_file, readability_file, output_file, use_cache=True):
     """
     Reads the input CSVs, merges data, aggregates by year, 
     and writes the results to the output CSV.
     """
     
-    # 1. Load readability scores into a lookup dictionary
+    # 1. Load readability scores into a lookup Series (indexed by celex)
     print(f"Loading readability data from {readability_file}...")
-    readability_scores = {}
     try:
-        with open(readability_file, mode='r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                celex = row.get('celex')
-                if not celex:
-                    continue
-                try:
-                    readability_scores[celex] = float(row.get('flesch_reading_ease', 0.0))
-                except (ValueError, TypeError):
-                    readability_scores[celex] = 0.0 # Default if conversion fails
+        readability_scores = load_readability_scores(readability_file, use_cache)
         print(f"Loaded readability scores for {len(readability_scores)} CELEX identifiers.")
     except FileNotFoundError:
         print(f"Error: Readability file not found at {readability_file}", file=sys.stderr)
@@ -64,64 +220,48 @@ def aggregate_data(word_count_file, readability_file, output_file):
         sys.exit(1)
 
 
-    # 2. Use defaultdict to store lists of values for std dev calculation
+    # 2. Use defaultdict to store the running moments of each group
     year_stats = defaultdict(lambda: {
-        'obl_finance_values': [],
-        'obl_agri_values': [],
-        'read_finance_values': [],
-        'read_agri_values': []
+        'obl_finance_values': Moments(),
+        'obl_agri_values': Moments(),
+        'read_finance_values': Moments(),
+        'read_agri_values': Moments()
     })
 
     print(f"Reading and aggregating word count data from {word_count_file}...")
     try:
-        with open(word_count_file, mode='r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
+        processed_rows = 0
+        missing_readability = 0
+        
+        # Only CHUNK_SIZE word count rows are held in memory at a time
+        for df in read_string_chunks(word_count_file, [
+            'celex', 'year_passed', 'year_enacted', 'is_finance',
+            'is_agriculture', 'total_obligation_word_count'
+        ]):
+            # Determine the year (prioritize 'year_passed'); skip rows
+            # without a valid year or without a celex
+            year_str = df['year_passed'].where(df['year_passed'] != '', df['year_enacted'])
+            df['year'], has_year = to_integers(year_str)
+            df = df[has_year & (df['celex'] != '')]
             
-            processed_rows = 0
-            missing_readability = 0
+            # Get obligation count (0 if not a valid integer)
+            df['obligation_count'], _ = to_integers(df['total_obligation_word_count'])
             
-            for row in reader:
-                # 1. Determine the year (prioritize 'year_passed')
-                year_str = row.get('year_passed') or row.get('year_enacted')
-                if not year_str:
-                    continue # Skip if no year is found
-                
-                try:
-                    year = int(year_str)
-                except ValueError:
-                    continue # Skip if year is not a valid integer
-
-                celex = row.get('celex')
-                if not celex:
-                    continue
-
-                # 2. Get obligation count
-                try:
-                    obligation_count = int(row.get('total_obligation_word_count', 0))
-                except ValueError:
-                    obligation_count = 0
-                
-                # 3. Get readability score from our lookup
-                readability_score = readability_scores.get(celex)
-                if readability_score is None:
-                    missing_readability += 1
-                
-                # 4. Check finance/agriculture flags
-                is_finance = row.get('is_finance') == '1'
-                is_agriculture = row.get('is_agriculture') == '1'
-
-                # 5. Aggregate lists of values
-                if is_finance:
-                    year_stats[year]['obl_finance_values'].append(obligation_count)
-                    if readability_score is not None:
-                        year_stats[year]['read_finance_values'].append(readability_score)
-                
-                if is_agriculture:
-                    year_stats[year]['obl_agri_values'].append(obligation_count)
-                    if readability_score is not None:
-                        year_stats[year]['read_agri_values'].append(readability_score)
-                
-                processed_rows += 1
+            # Get readability score from our lookup (NaN if missing)
+            df['readability_score'] = df['celex'].map(readability_scores)
+            
+            processed_rows += len(df)
+            missing_readability += int(df['readability_score'].isna().sum())
+            
+            # Aggregate the finance/agriculture rows of the chunk
+            for flag, obligation_key, readability_key in [
+                ('is_finance', 'obl_finance_values', 'read_finance_values'),
+                ('is_agriculture', 'obl_agri_values', 'read_agri_values')
+            ]:
+                rows = df[df[flag] == '1']
+                update_moments(year_stats, obligation_key, rows['obligation_count'], rows['year'])
+                rows = rows.dropna(subset=['readability_score'])
+                update_moments(year_stats, readability_key, rows['readability_score'], rows['year'])
         
         print(f"Successfully processed {processed_rows} rows from word count file.")
         if missing_readability > 0:
@@ -143,7 +283,7 @@ def aggregate_data(word_count_file, readability_file, output_file):
     for year in sorted(year_stats.keys()):
         stats = year_stats[year]
         
-        # Calculate stats for all four lists
+        # Calculate stats for all four groups
         (obl_fin_count, obl_fin_total, obl_fin_avg, obl_fin_std) = calculate_stats(stats['obl_finance_values'])
         (obl_agri_count, obl_agri_total, obl_agri_avg, obl_agri_std) = calculate_stats(stats['obl_agri_values'])
         (read_fin_count, _, read_fin_avg, read_fin_std) = calculate_stats(stats['read_finance_values'])
@@ -222,10 +362,21 @@ def main():
         required=True,
         help="Path for the output CSV aggregates file."
     )
+    parser.add_argument(
+        '--no_cache',
+        action='store_true',
+        help="Parse the readability file, ignoring and not updating the cached "
+             "scores ([readability_file].scores.pkl)."
+    )
     
     args = parser.parse_args()
     
-    aggregate_data(args.word_count_file, args.readability_file, args.output_file)
+    aggregate_data(
+        args.word_count_file,
+        args.readability_file,
+        args.output_file,
+        use_cache=not args.no_cache
+    )
 
 if __name__ == "__main__":
     main()
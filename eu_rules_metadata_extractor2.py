@@ -7,6 +7,13 @@ Parallel EURLEX/CELLAR metadata extractor with tqdm progress.
 - Parallelizes per-CELEX metadata retrieval (SPARQL + optional EUR-Lex title scrape).
 - Shows a single tqdm progress bar that advances as futures complete.
 - Adds --workers to control concurrency (default 16; set 1 for single-threaded).
+- Each worker thread keeps one HTTP session, so SPARQL queries and title
+  scrapes reuse kept-alive connections.
+- Fetches the metadata of a document, including the English labels of its
+  concept URIs, with a single SPARQL query.
+- Skips duplicate CELEX identifiers and, if the output file already exists,
+  those already in it, appending the rest (use --no_resume to start over).
+  Documents whose fetch failed are not written, so a re-run retries them.
 """
 
 import csv
@@ -15,16 +22,16 @@ import sys
 import os
 import time
 import random
+import threading
 from os.path import exists
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+from typing import List, Dict, Any, Optional
 
 from tqdm.auto import tqdm
 import requests
-from bs4 import BeautifulSoup
-
-from SPARQLWrapper import SPARQLWrapper, TURTLE, JSON
-from rdflib import Graph, Literal
+from requests.adapters import HTTPAdapter
+from lxml import etree
 
 # ----------------------------
 # CLI
@@ -49,6 +56,10 @@ argParser.add_argument(
     "--timeout", type=int, default=60,
     help="HTTP/SPARQL timeout in seconds (default: 60)"
 )
+argParser.add_argument(
+    "--no_resume", action="store_true",
+    help="Overwrite the output file instead of skipping the CELEX identifiers already in it."
+)
 args = argParser.parse_args()
 
 if args.input is None:
@@ -61,6 +72,7 @@ IN_CELEX_FILE = str(args.input)
 OUT_METADATA_FILE = str(args.output)
 MAX_WORKERS = max(1, int(args.workers))
 TIMEOUT = int(args.timeout)
+RESUME = not args.no_resume
 
 # ----------------------------
 # Constants & mappings
@@ -68,6 +80,10 @@ TIMEOUT = int(args.timeout)
 SPARQL_ENDPOINT_URL = "http://publications.europa.eu/webapi/rdf/sparql"
 CDM_PREFIX = "http://publications.europa.eu/ontology/cdm#"
 XSD_PREFIX = "http://www.w3.org/2001/XMLSchema#"
+SKOS_PREFIX = "http://www.w3.org/2004/02/skos/core#"
+
+# Accept header for SPARQL SELECT results
+JSON_MEDIA_TYPE = "application/sparql-results+json"
 
 property_mapping = {
     "celex"            : f"{CDM_PREFIX}resource_legal_id_celex",
@@ -85,12 +101,31 @@ property_mapping = {
     "subject_matters"  : f"{CDM_PREFIX}resource_legal_is_about_subject-matter"
 }
 
+
+# The mapped predicates, as a SPARQL VALUES list
+PREDICATE_VALUES = ' '.join(f"<{v}>" for v in property_mapping.values())
+
+# English expression titles, used when the work has no title
+EXPRESSION_TITLE = f"{CDM_PREFIX}expression_title"
+ENGLISH_LANGUAGE = "http://publications.europa.eu/resource/authority/language/ENG"
+
 metadata_header_row = [
     'celex', 'author', 'responsible_body', 'form', 'title', 'addressee',
     'date_adoption', 'date_in_force', 'date_end_validity',
     'directory_code', 'procedure_code', 'eurovoc', 'subject_matters'
 ]
 
+# Position of each column in an output row
+HEADER_INDEX = {h: i for i, h in enumerate(metadata_header_row)}
+
+# Predicate URI -> position of its column in an output row
+PRED_TO_INDEX = {v: HEADER_INDEX[k] for k, v in property_mapping.items()}
+
+USER_AGENT = "EuroMetaBot/1.0 (+https://example.com)"
+
+# Per-thread HTTP state (each worker thread keeps its own connections)
+_thread_state = threading.local()
+
 # ----------------------------
 # Helpers
 # ----------------------------
@@ -104,178 +139,288 @@ def read_celex_list(path: str) -> List[str]:
             if not cell or cell.lower() == "celex":
                 continue
             celex_nums.append(cell)
-    return celex_nums
+    # Each CELEX once, in input order
+    return list(dict.fromkeys(celex_nums))
+
+def read_done_celex(path: str) -> set:
+    """CELEX identifiers already in an output file of an earlier run.
+
+    A record cut short by an interrupted run is removed from the file. Records
+    end where csv.reader completes them, so a cut inside a quoted title that
+    spans several lines is found too.
+    """
+    done = set()
+    with open(path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        f.seek(0)
+        consumed = 0
+        last_line = b""
+        exhausted = False
+
+        def lines():
+            # Feed the reader line by line, counting the bytes it has consumed
+            nonlocal consumed, last_line, exhausted
+            for line in f:
+                consumed += len(line)
+                last_line = line
+                yield line.decode("utf-8", errors="replace")
+            exhausted = True
+
+        end = 0  # byte offset after the last complete record
+        try:
+            for row_number, row in enumerate(csv.reader(lines())):
+                # A record completed only by the end of the file (an open
+                # quote or a missing line break) is partial
+                if exhausted or not last_line.endswith(b"\n"):
+                    break
+                end = consumed
+                if row_number > 0 and row:  # not the header
+                    done.add(row[0])
+        except csv.Error:
+            pass
+        if end < size:
+            f.truncate(end)
+    return done
 
 def backoff_sleep(attempt: int, base: float = 0.8, cap: float = 8.0) -> None:
     # Exponential backoff with jitter
     delay = min(cap, base * (2 ** attempt)) + random.uniform(0, 0.3)
     time.sleep(delay)
 
+def get_session() -> requests.Session:
+    """Return this thread's HTTP session, created on first use.
+
+    The session keeps its connections alive, so consecutive requests from
+    the same worker to the same host reuse the TCP/TLS connection. Its
+    default headers ask for compressed responses (Accept-Encoding: gzip,
+    deflate), which requests decodes transparently; the SPARQL results and
+    EUR-Lex pages compress well.
+    """
+    session = getattr(_thread_state, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.headers.update({"User-Agent": USER_AGENT})
+        # One pooled connection per host: the SPARQL endpoint and EUR-Lex
+        # (with a single pool, switching host would close the other's
+        # connection). Retries are done by the callers, with backoff
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=1, max_retries=0)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _thread_state.session = session
+    return session
+
+class TitleFound(Exception):
+    """Raised by TitleFinder to stop parsing once the title is found."""
+
+class TitleFinder:
+    """lxml parser target that looks for <meta property="eli:title" lang="en">."""
+
+    def start(self, tag, attrib):
+        if tag == 'meta' and attrib.get('property') == 'eli:title' and attrib.get('lang') == 'en':
+            raise TitleFound(attrib.get('content') or '')
+
+    def close(self):
+        return ''
+
+def find_title(content: bytes) -> str:
+    """Return the EN eli:title of an EUR-Lex page ('' if none), without building a tree."""
+    # Parsing stops at the title, which is in the page's <head>
+    parser = etree.HTMLParser(target=TitleFinder(), encoding='utf-8')
+    try:
+        parser.feed(content)
+        return parser.close()
+    except TitleFound as found:
+        return found.args[0]
+
 def get_title_fallback(celex: str, timeout: int = TIMEOUT) -> str:
     """Scrape the EN title from EUR-Lex as a fallback."""
     url = f"https://eur-lex.europa.eu/legal-content/EN/ALL/?uri=CELEX:{celex}"
+    s = get_session()
     for attempt in range(4):
         try:
-            with requests.Session() as s:
-                s.headers.update({"User-Agent": "EuroMetaBot/1.0 (+https://example.com)"})
-                r = s.get(url, timeout=timeout)
-                if r.status_code >= 500:
-                    backoff_sleep(attempt)
-                    continue
-                soup = BeautifulSoup(r.content, 'lxml-xml')
-                res = soup.find('meta', attrs={"property": "eli:title", "lang": "en"})
-                return res.get('content') if res else ''
+            r = s.get(url, timeout=timeout)
+            if r.status_code >= 500:
+                backoff_sleep(attempt)
+                continue
+            return find_title(r.content)
         except Exception:
             backoff_sleep(attempt)
     return ''
 
-def execute_sparql_turtle(sparql: SPARQLWrapper, query: str) -> str:
-    """Run a SPARQL CONSTRUCT query, return data as TURTLE str; -1 sentinel on failure."""
-    sparql.setReturnFormat(TURTLE)
-    sparql.setQuery(query)
-    for attempt in range(4):
-        try:
-            res = sparql.query().convert()
-            return res.decode("utf-8")
-        except Exception:
-            backoff_sleep(attempt)
-    return -1  # sentinel
+def run_sparql(endpoint_url: str, query: str, accept: str, timeout: int) -> requests.Response:
+    """POST a SPARQL query with this thread's session; raise on HTTP errors."""
+    r = get_session().post(
+        endpoint_url, data={"query": query}, headers={"Accept": accept}, timeout=timeout
+    )
+    r.raise_for_status()
+    return r
 
-def get_string_label(sparql: SPARQLWrapper, uri: str, pred: str) -> str:
-    """Dereference a URI to its English skos:prefLabel; specialized handling for directory_code."""
-    u = uri
-    if pred == 'directory_code':
-        # keep the most general segment (first two digits)
-        parts = uri.split('/')
-        if parts:
-            dc = parts[-1][:2]
-            u = '/'.join(parts[:-1] + [dc])
-
-    q = f"""
-    PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
-    SELECT (STR(?o) AS ?label)
-    WHERE {{
-        <{u}> skos:prefLabel ?o .
-        FILTER (lang(?o) = "en")
-    }}
-    """
-    sparql.setReturnFormat(JSON)
-    sparql.setQuery(q)
+def execute_sparql_select(query: str, endpoint_url: str, timeout: int) -> List[Dict[str, Any]]:
+    """Run a SPARQL SELECT query, return its JSON result bindings; -1 sentinel on failure."""
     for attempt in range(4):
         try:
-            res = sparql.query().convert()
-            bindings = res.get("results", {}).get("bindings", [])
-            if not bindings:
-                return ''
-            return bindings[0]["label"]["value"]
+            res = run_sparql(endpoint_url, query, JSON_MEDIA_TYPE, timeout).json()
+            return res.get("results", {}).get("bindings", [])
         except Exception:
             backoff_sleep(attempt)
-    return ''
+    return -1  # sentinel
 
 # ----------------------------
 # Core per-document worker
 # ----------------------------
-def process_celex(celex_num: str, endpoint_url: str, timeout: int) -> List[str]:
-    """Fetch and assemble one row of metadata for a given CELEX."""
-    # One SPARQLWrapper per thread to avoid thread-safety issues
-    sparql = SPARQLWrapper(endpoint_url)
-    sparql.setTimeout(timeout)
-    sparql.setReturnFormat(TURTLE)
-
+def process_celex(celex_num: str, endpoint_url: str, timeout: int) -> Optional[List[str]]:
+    """Fetch and assemble one row of metadata for a given CELEX (None if the query failed)."""
+    # One query for all mapped values of the document. Object URIs come with
+    # their English skos:prefLabel (unbound if there is none); a directory
+    # code is labelled by its most general code (the first two digits of the
+    # last URI segment), computed by the server. The second branch adds the
+    # titles of the English expressions of the work, as ?p = cdm:expression_title.
     metadata_query = f"""
     PREFIX cdm: <{CDM_PREFIX}>
     PREFIX xsd: <{XSD_PREFIX}>
+    PREFIX skos: <{SKOS_PREFIX}>
 
-    CONSTRUCT {{ ?s ?p ?o }}
+    SELECT DISTINCT ?s ?p ?o ?label
     WHERE {{
-      SELECT DISTINCT ?s ?p ?o WHERE {{
-         ?s cdm:resource_legal_id_celex "{celex_num}"^^xsd:string .
-         ?s ?p ?o .
+      ?s cdm:resource_legal_id_celex "{celex_num}"^^xsd:string .
+      {{
+        VALUES ?p {{ {PREDICATE_VALUES} }}
+        ?s ?p ?o .
+        BIND (IF(?p = <{property_mapping['directory_code']}> && isIRI(?o),
+                 IRI(REPLACE(STR(?o), "^(.*/[^/]{{0,2}})[^/]*$", "$1")),
+                 ?o) AS ?label_uri)
+        OPTIONAL {{
+          ?label_uri skos:prefLabel ?label .
+          FILTER (lang(?label) = "en")
+        }}
+      }}
+      UNION
+      {{
+        ?e cdm:expression_belongs_to_work ?s ;
+           cdm:expression_title ?o .
+        FILTER (lang(?o) = "en" || EXISTS {{ ?e cdm:expression_uses_language <{ENGLISH_LANGUAGE}> }})
+        BIND (cdm:expression_title AS ?p)
       }}
     }}
     """
 
-    current_row: Dict[str, Any] = {
-        "celex": [], "author": [], "responsible_body": [], "form": [],
-        "title": [], "addressee": [], "date_adoption": [], "date_in_force": [],
-        "date_end_validity": [], "directory_code": [], "procedure_code": [],
-        "eurovoc": [], "subject_matters": []
-    }
-
-    turtle = execute_sparql_turtle(sparql, metadata_query)
-    if turtle == -1:
-        # Return a minimal row with the celex, leave others blank
+    bindings = execute_sparql_select(metadata_query, endpoint_url, timeout)
+    if bindings == -1:
+        # Query failed after retries: no row, so that a resumed run retries it
+        return None
+    if not bindings:
+        # CELLAR has no resource with this CELEX (then there is nothing to
+        # collect and no title to scrape either):
+        # return a minimal row with the celex, leave others blank
         return [celex_num] + [''] * (len(metadata_header_row) - 1)
 
-    # Parse the RDF, collect values
-    g = Graph().parse(data=str(turtle), format='turtle')
-    pm_values = set(property_mapping.values())
-    for s, p, o in g.triples((None, None, None)):
-        p_str = str(p)
-        if p_str in pm_values:
-            # Which key is this predicate?
-            key = next(k for k, v in property_mapping.items() if v == p_str)
-            if isinstance(o, Literal):
-                current_row[key].append(str(o))
-            else:
-                lbl = get_string_label(sparql, str(o), key)
-                current_row[key].append(lbl)
+    # Collect values per column (in header order): literals as they are,
+    # object URIs by their label
+    row: List[Any] = [[] for _ in metadata_header_row]
+    labelled = set()
+    expression_titles = []
+    for b in bindings:
+        p = b["p"]["value"]
+        o = b["o"]
+        if p == EXPRESSION_TITLE:
+            expression_titles.append(o["value"])
+            continue
+        i = PRED_TO_INDEX.get(p)
+        if i is None:
+            continue
+        if o["type"] in ("literal", "typed-literal"):
+            row[i].append(o["value"])
+        else:
+            # One value per object URI, even if it has several English labels
+            triple = (b["s"]["value"], p, o["value"])
+            if triple in labelled:
+                continue
+            labelled.add(triple)
+            row[i].append(b["label"]["value"] if "label" in b else '')
+
+    # A work without a title takes the titles of its English expressions
+    title = HEADER_INDEX['title']
+    if not row[title]:
+        row[title] = expression_titles
 
-    # Normalize field lists to strings
-    for k, v in current_row.items():
+    # Normalize field lists to strings, in place
+    for i, v in enumerate(row):
         if not v:
-            current_row[k] = ''
+            row[i] = ''
         elif len(v) == 1:
-            current_row[k] = v[0]
+            row[i] = v[0]
         else:
             # de-duplicate and join with ' | ' like the original
-            current_row[k] = ' | '.join(sorted(set(v)))
+            row[i] = ' | '.join(sorted(set(v)))
 
-    # Fallback for missing title
-    if not current_row['title']:
-        current_row['title'] = get_title_fallback(celex_num, timeout=timeout)
+    # Last resort for a missing title: scrape it from EUR-Lex
+    if not row[title]:
+        row[title] = get_title_fallback(celex_num, timeout=timeout)
 
-    # Return in header order
-    return [current_row[f] if f != 'celex' else celex_num for f in metadata_header_row]
+    row[HEADER_INDEX['celex']] = celex_num
+    return row
 
 # ----------------------------
 # Orchestrators (parallel + sequential)
 # ----------------------------
-def get_metadata_parallel(celex_nums: List[str], endpoint_url: str, timeout: int, max_workers: int) -> List[List[str]]:
-    """Parallel path with a single tqdm bar that ticks as futures complete."""
-    rows: List[List[str]] = [metadata_header_row]  # header first
+def get_metadata_parallel(celex_nums: List[str], endpoint_url: str, timeout: int, max_workers: int, writer: Any) -> int:
+    """Parallel path with a single tqdm bar that ticks as futures complete.
+
+    Rows are written with writer (in this thread) as soon as they are complete.
+    At most 4 * max_workers documents are in flight at a time, so the pending
+    futures do not grow with the number of CELEX identifiers.
+    Returns the number of documents that failed (and were not written).
+    """
+    failed = 0
     if not celex_nums:
-        return rows
+        return failed
 
+    remaining = iter(celex_nums)
     with ThreadPoolExecutor(max_workers=max_workers) as ex:
-        futures = {ex.submit(process_celex, c, endpoint_url, timeout): c for c in celex_nums}
-        with tqdm(total=len(futures), desc="Fetching", unit="doc", dynamic_ncols=True) as pbar:
-            for fut in as_completed(futures):
-                celex_id = futures[fut]
-                try:
-                    row = fut.result()
-                except Exception as e:
-                    tqdm.write(f"[WARN] {celex_id}: {e}")
-                    row = [celex_id] + [''] * (len(metadata_header_row) - 1)
-                rows.append(row)
-                pbar.update(1)
-    return rows
-
-def get_metadata_sequential(celex_nums: List[str], endpoint_url: str, timeout: int) -> List[List[str]]:
-    """Single-thread path with per-item tqdm bar (classic)."""
-    rows: List[List[str]] = [metadata_header_row]
+        futures = {ex.submit(process_celex, c, endpoint_url, timeout): c
+                   for c in islice(remaining, 4 * max_workers)}
+        with tqdm(total=len(celex_nums), desc="Fetching", unit="doc", dynamic_ncols=True) as pbar:
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    celex_id = futures.pop(fut)
+                    try:
+                        row = fut.result()
+                    except Exception as e:
+                        tqdm.write(f"[WARN] {celex_id}: {e}")
+                        row = None
+                    if row is None:
+                        failed += 1
+                    else:
+                        writer.writerow(row)
+                    pbar.update(1)
+                # Refill the window with as many documents as were completed
+                for c in islice(remaining, len(done)):
+                    futures[ex.submit(process_celex, c, endpoint_url, timeout)] = c
+    return failed
+
+def get_metadata_sequential(celex_nums: List[str], endpoint_url: str, timeout: int, writer: Any) -> int:
+    """Single-thread path with per-item tqdm bar (classic); rows are written with writer.
+
+    Returns the number of documents that failed (and were not written).
+    """
+    failed = 0
     if not celex_nums:
-        return rows
+        return failed
 
     with tqdm(total=len(celex_nums), desc="CELEX", unit="doc", dynamic_ncols=True) as pbar:
         for c in celex_nums:
             try:
-                rows.append(process_celex(c, endpoint_url, timeout))
+                row = process_celex(c, endpoint_url, timeout)
             except Exception as e:
                 tqdm.write(f"[WARN] {c}: {e}")
-                rows.append([c] + [''] * (len(metadata_header_row) - 1))
+                row = None
+            if row is None:
+                failed += 1
+            else:
+                writer.writerow(row)
             pbar.update(1)
-    return rows
+    return failed
 
 # ----------------------------
 # Main
@@ -283,21 +428,33 @@ def get_metadata_sequential(celex_nums: List[str], endpoint_url: str, timeout: i
 def main():
     celex_nums = read_celex_list(IN_CELEX_FILE)
 
-    st = time.time()
-    if MAX_WORKERS == 1:
-        metadata = get_metadata_sequential(celex_nums, SPARQL_ENDPOINT_URL, TIMEOUT)
-    else:
-        metadata = get_metadata_parallel(celex_nums, SPARQL_ENDPOINT_URL, TIMEOUT, MAX_WORKERS)
-    et = time.time()
+    # Resume an earlier run: only fetch the CELEX identifiers not yet in the output
+    resume = RESUME and exists(OUT_METADATA_FILE)
+    if resume:
+        done = read_done_celex(OUT_METADATA_FILE)
+        celex_nums = [c for c in celex_nums if c not in done]
+        print(f"Resuming {OUT_METADATA_FILE}: {len(done)} CELEX identifiers already done, "
+              f"{len(celex_nums)} to fetch.")
 
-    # Save CSV
+    # The CSV is written row by row while the documents are processed,
+    # so the metadata is never all held in memory
     os.makedirs(os.path.dirname(OUT_METADATA_FILE) or ".", exist_ok=True)
-    with open(OUT_METADATA_FILE, 'w', newline='', encoding='utf-8') as f:
+    st = time.time()
+    with open(OUT_METADATA_FILE, 'a' if resume else 'w', newline='', encoding='utf-8') as f:
         w = csv.writer(f)
-        w.writerows(metadata)
+        if f.tell() == 0:
+            w.writerow(metadata_header_row)
+        if MAX_WORKERS == 1:
+            failed = get_metadata_sequential(celex_nums, SPARQL_ENDPOINT_URL, TIMEOUT, w)
+        else:
+            failed = get_metadata_parallel(celex_nums, SPARQL_ENDPOINT_URL, TIMEOUT, MAX_WORKERS, w)
+    et = time.time()
 
     print(f"Processed {len(celex_nums)} documents in {et - st:.1f}s "
           f"({(et - st)/max(1,len(celex_nums)):.2f} s/doc; workers={MAX_WORKERS}).")
+    if failed:
+        print(f"Warning: {failed} documents could not be fetched and were not written; "
+              f"re-run to retry them.", file=sys.stderr)
 
 if __name__ == "__main__":
     main()
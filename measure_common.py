@@ -0,0 +1,124 @@
+"""
+Functions shared by the 06_measure_*_prepared.py scripts: loading the
+CELEX list and matching it against the directory of TXT files.
+"""
+
+import csv
+import operator
+import os
+import sys
+
+# Buffer size for reading CSV input files (larger than the 8 KiB default,
+# for fewer read calls on large files)
+READ_BUFFER_SIZE = 1 << 20
+
+# Columns read from the CELEX list, with their defaults if missing
+CELEX_LIST_COLUMNS = [
+    ('celex', None),
+    ('year_passed', None),
+    ('year_enacted', None),
+    ('is_finance', '0'),
+    ('is_agriculture', '0')
+]
+
+def load_celex_list(celex_file):
+    """
+    Loads the CELEX list and filters for rows where 'is_finance'
+    or 'is_agriculture' is '1'.
+    
+    Returns a list of dictionaries, each containing celex, 
+    year_passed, year_enacted, is_finance, and is_agriculture 
+    for processing, and the set of these CELEX identifiers.
+    """
+    celex_to_process = []
+    celex_set = set()
+    print(f"Loading CELEX list from {celex_file}...")
+    try:
+        with open(celex_file, mode='r', encoding='utf-8', buffering=READ_BUFFER_SIZE) as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            
+            # Fields are taken from each row by position. Short rows are
+            # padded with None and missing columns read as their default,
+            # as with csv.DictReader and row.get.
+            column_index = {name: i for i, name in enumerate(header)}
+            missing_defaults = []
+            positions = []
+            for name, default in CELEX_LIST_COLUMNS:
+                if name not in column_index:
+                    column_index[name] = len(header) + len(missing_defaults)
+                    missing_defaults.append(default)
+                positions.append(column_index[name])
+            get_fields = operator.itemgetter(*positions)
+            width = len(header)
+            
+            for row in reader:
+                if not row:
+                    continue # Skip blank lines, as csv.DictReader does
+                if len(row) < width:
+                    row += [None] * (width - len(row))
+                if missing_defaults:
+                    row = row[:width] + missing_defaults
+                    
+                celex, year_passed, year_enacted, is_finance, is_agriculture = get_fields(row)
+                
+                if is_finance == '1' or is_agriculture == '1':
+                    if celex:
+                        celex_info = {
+                            'celex': celex,
+                            'year_passed': year_passed,
+                            'year_enacted': year_enacted,
+                            'is_finance': is_finance,
+                            'is_agriculture': is_agriculture
+                        }
+                        celex_to_process.append(celex_info)
+                        celex_set.add(celex)
+                        
+    except FileNotFoundError:
+        print(f"Error: CELEX file not found at {celex_file}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"Error reading CELEX file: {e}", file=sys.stderr)
+        sys.exit(1)
+        
+    print(f"Loaded {len(celex_to_process)} CELEX identifiers marked for processing.")
+    return celex_to_process, celex_set
+
+def match_txt_files(celex_file, txt_directory, celex_set_from_list):
+    """
+    Lists the [celex].txt files in txt_directory and prints a report of
+    how they match the CELEX identifiers loaded from celex_file.
+    
+    Returns the set of CELEX identifiers with a .txt file.
+    """
+    print(f"\nAnalyzing file match between {celex_file} and {txt_directory}...")
+    
+    try:
+        # scandir's entries carry the file type from the directory listing,
+        # so is_file() needs no extra stat call per file
+        with os.scandir(txt_directory) as entries:
+            celex_set_from_dir = {
+                entry.name[:-len('.txt')] for entry in entries
+                if entry.name.endswith('.txt') and entry.is_file()
+            }
+    except FileNotFoundError:
+        print(f"Error: TXT directory not found at {txt_directory}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"Error reading TXT directory: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    matched_celex_count = len(celex_set_from_list.intersection(celex_set_from_dir))
+    list_not_found_in_dir_count = len(celex_set_from_list.difference(celex_set_from_dir))
+    dir_not_found_in_list_count = len(celex_set_from_dir.difference(celex_set_from_list))
+
+    print("\n--- File Matching Report ---")
+    print(f"  - CELEX IDs in list:          {len(celex_set_from_list)}")
+    print(f"  - .txt files in directory:    {len(celex_set_from_dir)}")
+    print(f"  ------------------------------")
+    print(f"  - Matched (in list & dir):    {matched_celex_count}")
+    print(f"  - In list, NOT in dir (.txt): {list_not_found_in_dir_count}")
+    print(f"  - In dir (.txt), NOT in list: {dir_not_found_in_list_count}")
+    print("------------------------------")
+
+    return celex_set_from_dir